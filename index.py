@@ -7,10 +7,23 @@ Fitur:
 - Tampilan interaktif memakai Bootstrap 5 (CDN)
 
 Cara pakai:
-1. Pasang dependensi: pip install flask
-2. Jalankan: python Aplikasi_Pendataan_Mahasiswa.py
+1. Pasang dependensi: pip install flask bcrypt
+   (opsional: pip install waitress, agar python index.py melayani 8 request sekaligus;
+   tanpa waitress dipakai server pengembangan Flask dengan debug=True)
+2. Jalankan: python index.py
 3. Buka browser: http://127.0.0.1:5000
 
+Produksi (banyak request sekaligus, worker thread):
+1. Pasang: pip install gunicorn
+2. Buat database sekali: python -c "import index; index.init_db()"
+   Jalankan lagi setiap upgrade (aman diulang): init_db melengkapi index,
+   termasuk UNIQUE nilai(enroll_id) yang dibutuhkan penyimpanan nilai.
+3. Jalankan: gunicorn -k gthread -w 2 --threads 8 index:app
+   Setiap thread memakai satu koneksi sqlite dari _pool (threading.local),
+   jadi paling banyak 2 x 8 koneksi. Jangan pakai worker gevent/eventlet:
+   threading.local menjadi per-greenlet sehingga setiap koneksi klien
+   membuka koneksi sqlite baru yang tidak pernah ditutup.
+
 Akun awal:
 - Admin: username=admin password=admin123
 - Dosen: username=dosen1 password=dosen123
@@ -19,55 +32,185 @@ Akun awal:
 Catatan keamanan: ini contoh belajar. Jangan gunakan password plaintext di produksi.
 """
 
-from flask import Flask, render_template_string, request, redirect, url_for, session, flash, g
+from flask import Flask, Response, stream_with_context, render_template, make_response, request, redirect, url_for, session, flash, g
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
-from functools import wraps
+from werkzeug.security import check_password_hash
+import bcrypt
+from markupsafe import Markup, escape
+from functools import wraps, lru_cache
 import os
+import threading
+import re
+import hashlib
+import jinja2
 
 DB_PATH = 'mahasiswa.db'
 app = Flask(__name__)
 app.secret_key = 'ganti_dengan_rahasia_yang_kuat'
+# bytecode template disimpan di direktori temp, dipakai ulang antar restart/worker
+app.jinja_env.bytecode_cache = jinja2.FileSystemBytecodeCache()
 
 # -----------------
 # Database helpers
 # -----------------
 
+# satu koneksi per thread, dipakai ulang antar request (tidak ditutup di teardown,
+# tetapi transaksi yang tertinggal di-rollback, lihat end_transaction)
+_pool = threading.local()
+
+DB_PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA cache_size=-20000',
+    'PRAGMA foreign_keys=ON',
+)
+
+# query yang paling sering dipakai; teks SQL yang sama = hit di cache prepared statement
+_SQL_GET_USER = 'SELECT id, password_hash, role, full_name FROM users WHERE username=?'
+_SQL_COUNTS = 'SELECT (SELECT COUNT(*) FROM mahasiswa) a, (SELECT COUNT(*) FROM dosen) b, (SELECT COUNT(*) FROM mata_kuliah) c'
+# area dosen & mahasiswa
+_SQL_DOSEN_KELAS = 'SELECT k.id, k.nama, mk.nama FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id WHERE k.dosen_id=?'
+_SQL_DOSEN_KELAS_DETAIL = 'SELECT k.nama, mk.nama FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id WHERE k.id=? AND k.dosen_id=?'
+_SQL_KELAS_NILAI = 'SELECT e.id, u.full_name, u.username, n.nilai_angka FROM enroll e JOIN mahasiswa m ON e.mahasiswa_id=m.id JOIN users u ON m.id=u.id LEFT JOIN nilai n ON n.enroll_id=e.id WHERE e.kelas_id=?'
+_SQL_KELAS_JADWAL = 'SELECT hari, jam FROM jadwal WHERE kelas_id=? ORDER BY id'
+_SQL_ENROLL_DOSEN = 'SELECT e.kelas_id, k.dosen_id FROM enroll e JOIN kelas k ON e.kelas_id=k.id WHERE e.id=?'
+_SQL_MHS_PROFILE = 'SELECT u.id, u.username, u.full_name, m.nim, m.alamat, m.phone FROM users u JOIN mahasiswa m ON u.id=m.id WHERE u.id=?'
+# satu baris per enroll; jadwal digabung dengan GROUP_CONCAT
+_SQL_MHS_KELAS = "SELECT k.nama as kelas_nama, mk.nama as mk_nama, n.nilai_angka, GROUP_CONCAT(j.hari, '/') as hari, GROUP_CONCAT(j.jam, '/') as jam FROM enroll e JOIN kelas k ON e.kelas_id=k.id JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN nilai n ON n.enroll_id=e.id LEFT JOIN jadwal j ON j.kelas_id=k.id WHERE e.mahasiswa_id=? GROUP BY e.id"
+# upsert nilai sekaligus cek kepemilikan: 0 baris berubah = enroll bukan milik kelas dosen ini
+_SQL_UPSERT_NILAI = 'INSERT INTO nilai (enroll_id, nilai_angka) SELECT e.id, ? FROM enroll e JOIN kelas k ON e.kelas_id=k.id WHERE e.id=? AND k.dosen_id=? ON CONFLICT(enroll_id) DO UPDATE SET nilai_angka=excluded.nilai_angka'
+
 def get_db():
-    db = getattr(g, '_database', None)
+    db = getattr(_pool, 'db', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_PATH)
+        db = _pool.db = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
         db.row_factory = sqlite3.Row
+        apply_pragmas(db)
     return db
 
-@app.teardown_appcontext
-def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+
+@app.teardown_request
+def end_transaction(exception):
+    # write yang gagal di tengah request tidak boleh menahan write lock di koneksi thread ini
+    db = getattr(_pool, 'db', None)
+    if db is not None and db.in_transaction:
+        db.rollback()
+
+
+def apply_pragmas(db):
+    for pragma in DB_PRAGMAS:
+        db.execute(pragma)
 
 
-def query_db(query, args=(), one=False):
-    cur = get_db().execute(query, args)
+def query_db(query, args=(), one=False, row_as_tuple=False):
+    # SELECT yang sama dalam satu request diambil dari cache (umur g = satu request)
+    cacheable = query.lstrip().upper().startswith('SELECT')
+    if cacheable:
+        cache = g.setdefault('_qcache', {})
+        key = (query, tuple(args), one, row_as_tuple)
+        if key in cache:
+            return cache[key]
+    cur = get_db().cursor()
+    if row_as_tuple:
+        # tuple biasa, tanpa membuat sqlite3.Row per baris
+        cur.row_factory = None
+    cur.execute(query, args)
     rv = cur.fetchall()
     cur.close()
-    return (rv[0] if rv else None) if one else rv
+    rv = (rv[0] if rv else None) if one else rv
+    if cacheable:
+        cache[key] = rv
+    return rv
 
 
 def execute_db(query, args=()):
+    g.pop('_qcache', None)
     db = get_db()
-    cur = db.execute(query, args)
-    db.commit()
+    # commit jika berhasil, rollback jika statement gagal (mis. foreign key)
+    with db:
+        cur = db.execute(query, args)
     return cur.lastrowid
 
+
+def tx():
+    # beberapa statement, satu commit: `with tx() as db: ...`
+    g.pop('_qcache', None)
+    return get_db()
+
+# -----------------
+# Password helpers
+# -----------------
+
+BCRYPT_ROUNDS = 10
+# bcrypt hanya memakai 72 byte pertama; bcrypt >= 5 menolak password yang lebih panjang
+BCRYPT_MAX_BYTES = 72
+
+def password_too_long(password):
+    return len(password.encode()) > BCRYPT_MAX_BYTES
+
+
+def hash_password(password):
+    if password_too_long(password):
+        raise ValueError('password maksimal %d byte' % BCRYPT_MAX_BYTES)
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(BCRYPT_ROUNDS)).decode()
+
+
+def verify_password(pw_hash, password):
+    if pw_hash.startswith('$2'):
+        if password_too_long(password):
+            return False
+        try:
+            return bcrypt.checkpw(password.encode(), pw_hash.encode())
+        except ValueError:
+            # hash rusak di database
+            return False
+    # hash lama (werkzeug pbkdf2)
+    return check_password_hash(pw_hash, password)
+
 # -----------------
 # Init DB
 # -----------------
 
+# hash bcrypt (cost 10) akun awal, dihitung sekali agar init_db tidak perlu hashing
+SEED_ADMIN_HASH = '$2b$10$Y/2./Etg7Zga3xu8UJFdhusoVihS.0qHRHkjXjUzlyI4sYJBpGeCu'  # admin123
+SEED_DOSEN_HASH = '$2b$10$VY0V8tCYLgoTBJhS4nlnTONm0j1sLOYsnQ7xHm7hVSxHc3rj7Dcz2'  # dosen123
+SEED_MAHASISWA_HASH = '$2b$10$z8O.DGE69szMupLeOdL2b.2LLLlF0lAatH6WqlKfM0dIVnus/bBIa'  # mahasiswa123
+
+# IF NOT EXISTS: aman dijalankan ulang pada database yang sudah ada.
+# UNIQUE di nilai(enroll_id) dibutuhkan upsert ON CONFLICT(enroll_id).
+DB_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_enroll_mhs ON enroll(mahasiswa_id)',
+    'CREATE INDEX IF NOT EXISTS idx_enroll_kelas ON enroll(kelas_id)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_nilai_enroll ON nilai(enroll_id)',
+    'CREATE INDEX IF NOT EXISTS idx_kelas_mk ON kelas(mata_kuliah_id)',
+    'CREATE INDEX IF NOT EXISTS idx_kelas_dosen ON kelas(dosen_id)',
+    'CREATE INDEX IF NOT EXISTS idx_jadwal_kelas ON jadwal(kelas_id)',
+)
+
+# database lama bisa punya lebih dari satu nilai per enroll; yang terbaru dipertahankan
+_SQL_DEDUP_NILAI = 'DELETE FROM nilai WHERE enroll_id IS NOT NULL AND id NOT IN (SELECT MAX(id) FROM nilai GROUP BY enroll_id)'
+
+def create_indexes(db):
+    if not db.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_nilai_enroll'").fetchone():
+        # tanpa ini CREATE UNIQUE INDEX gagal dan init_db berhenti
+        db.execute(_SQL_DEDUP_NILAI)
+    for stmt in DB_INDEXES:
+        db.execute(stmt)
+    db.commit()
+
+
 def init_db():
     if os.path.exists(DB_PATH):
+        # database lama: cukup lengkapi index yang belum ada
+        db = sqlite3.connect(DB_PATH)
+        apply_pragmas(db)
+        create_indexes(db)
+        db.close()
         return
     db = sqlite3.connect(DB_PATH)
+    apply_pragmas(db)
     c = db.cursor()
     # users: id, username, password_hash, role, full_name
     c.execute('''CREATE TABLE users (
@@ -82,12 +225,14 @@ def init_db():
                  id INTEGER PRIMARY KEY,
                  nim TEXT,
                  alamat TEXT,
-                 phone TEXT
+                 phone TEXT,
+                 FOREIGN KEY(id) REFERENCES users(id) ON DELETE CASCADE
                  )''')
     # dosen: id->users.id, nidn
     c.execute('''CREATE TABLE dosen (
                  id INTEGER PRIMARY KEY,
-                 nidn TEXT
+                 nidn TEXT,
+                 FOREIGN KEY(id) REFERENCES users(id) ON DELETE CASCADE
                  )''')
     # mata_kuliah: id, kode, nama, sks
     c.execute('''CREATE TABLE mata_kuliah (
@@ -103,7 +248,7 @@ def init_db():
                  mata_kuliah_id INTEGER,
                  dosen_id INTEGER,
                  FOREIGN KEY(mata_kuliah_id) REFERENCES mata_kuliah(id),
-                 FOREIGN KEY(dosen_id) REFERENCES dosen(id)
+                 FOREIGN KEY(dosen_id) REFERENCES dosen(id) ON DELETE SET NULL
                  )''')
     # jadwal: id, kelas_id, hari, jam
     c.execute('''CREATE TABLE jadwal (
@@ -118,29 +263,25 @@ def init_db():
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
                  mahasiswa_id INTEGER,
                  kelas_id INTEGER,
-                 FOREIGN KEY(mahasiswa_id) REFERENCES mahasiswa(id),
+                 FOREIGN KEY(mahasiswa_id) REFERENCES mahasiswa(id) ON DELETE CASCADE,
                  FOREIGN KEY(kelas_id) REFERENCES kelas(id)
                  )''')
-    # nilai: id, enroll_id, nilai_angka
+    # nilai: id, enroll_id (satu nilai per enroll, lihat DB_INDEXES), nilai_angka
     c.execute('''CREATE TABLE nilai (
                  id INTEGER PRIMARY KEY AUTOINCREMENT,
                  enroll_id INTEGER,
                  nilai_angka REAL,
-                 FOREIGN KEY(enroll_id) REFERENCES enroll(id)
+                 FOREIGN KEY(enroll_id) REFERENCES enroll(id) ON DELETE CASCADE
                  )''')
+    # index untuk kolom foreign key (join & delete)
+    create_indexes(db)
 
     # seed users
-    from werkzeug.security import generate_password_hash
-    admin_pw = generate_password_hash('admin123')
-    dosen_pw = generate_password_hash('dosen123')
-    mhs_pw = generate_password_hash('mahasiswa123')
-
-    c.execute("INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)",
-              ('admin', admin_pw, 'admin', 'Administrator'))
-    c.execute("INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)",
-              ('dosen1', dosen_pw, 'dosen', 'Dr. Dosen Satu'))
-    c.execute("INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)",
-              ('mahasiswa1', mhs_pw, 'mahasiswa', 'Budi Mahasiswa'))
+    c.executemany("INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)", [
+        ('admin', SEED_ADMIN_HASH, 'admin', 'Administrator'),
+        ('dosen1', SEED_DOSEN_HASH, 'dosen', 'Dr. Dosen Satu'),
+        ('mahasiswa1', SEED_MAHASISWA_HASH, 'mahasiswa', 'Budi Mahasiswa'),
+    ])
 
     # link mahasiswa and dosen
     admin_id = c.execute("SELECT id FROM users WHERE username=?", ('admin',)).fetchone()[0]
@@ -180,69 +321,93 @@ def login_required(role=None):
         return decorated_function
     return decorator
 
+
+def etag_from(tables):
+    # Versi tabel = MAX(rowid) & COUNT(*), cukup satu SELECT. Hanya mendeteksi INSERT/DELETE,
+    # jadi jangan dipakai untuk halaman yang datanya bisa berubah lewat UPDATE.
+    version_sql = 'SELECT ' + ', '.join('(SELECT MAX(rowid) FROM %s), (SELECT COUNT(*) FROM %s)' % (t, t) for t in tables)
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # halaman dengan flash message yang belum tampil tidak boleh dijawab 304
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            version = (session.get('user_id'),) + tuple(query_db(version_sql, one=True))
+            etag = '-'.join(str(v) for v in version)
+            if etag in request.if_none_match:
+                # 304 tetap membawa ETag & Cache-Control yang sama (seperti make_conditional)
+                resp = make_response('', 304)
+            else:
+                resp = make_response(f(*args, **kwargs))
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'private, no-cache'
+            return resp
+        return decorated_function
+    return decorator
+
+
+def etag_body(f):
+    # ETag dari isi halaman, untuk halaman yang datanya bisa berubah lewat UPDATE (nilai).
+    # Halaman tetap di-render, tetapi reload dengan isi sama hanya dijawab 304 tanpa body.
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes'):
+            return f(*args, **kwargs)
+        resp = make_response(f(*args, **kwargs))
+        if resp.status_code != 200 or resp.is_streamed:
+            return resp
+        resp.set_etag(hashlib.blake2b(resp.get_data(), digest_size=8).hexdigest())
+        resp.headers['Cache-Control'] = 'private, no-cache'
+        return resp.make_conditional(request)
+    return decorated_function
+
 # -----------------
-# Templates (simple, inline for single-file)
+# Templates (layout di templates/base.html)
 # -----------------
 
-base_html = """
-<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1">
-    <title>{{ title or 'Aplikasi Mahasiswa' }}</title>
-    <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-    <style>
-      body { padding-top: 70px; }
-      .card-glow { box-shadow: 0 6px 18px rgba(0,0,0,0.08); border-radius: 12px; }
-    </style>
-  </head>
-  <body>
-    <nav class="navbar navbar-expand-lg navbar-dark bg-primary fixed-top">
-      <div class="container-fluid">
-        <a class="navbar-brand" href="{{ url_for('index') }}">SI-Mahasiswa</a>
-        <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navBar" aria-controls="navBar" aria-expanded="false" aria-label="Toggle navigation">
-          <span class="navbar-toggler-icon"></span>
-        </button>
-        <div class="collapse navbar-collapse" id="navBar">
-          <ul class="navbar-nav me-auto mb-2 mb-lg-0">
-            {% if session.get('user_id') %}
-              {% if session.get('role') == 'admin' %}
-                <li class="nav-item"><a class="nav-link" href="{{ url_for('admin_dashboard') }}">Admin</a></li>
-              {% elif session.get('role') == 'dosen' %}
-                <li class="nav-item"><a class="nav-link" href="{{ url_for('dosen_dashboard') }}">Dosen</a></li>
-              {% else %}
-                <li class="nav-item"><a class="nav-link" href="{{ url_for('mhs_dashboard') }}">Mahasiswa</a></li>
-              {% endif %}
-            {% endif %}
-          </ul>
-          <ul class="navbar-nav">
-            {% if session.get('user_id') %}
-              <li class="nav-item"><a class="nav-link">{{ session.get('full_name') }} ({{ session.get('role') }})</a></li>
-              <li class="nav-item"><a class="nav-link" href="{{ url_for('logout') }}">Logout</a></li>
-            {% else %}
-              <li class="nav-item"><a class="nav-link" href="{{ url_for('login') }}">Login</a></li>
-            {% endif %}
-          </ul>
-        </div>
-      </div>
-    </nav>
-
-    <div class="container">
-      {% with messages = get_flashed_messages() %}
-        {% if messages %}
-          {% for m in messages %}
-            <div class="alert alert-warning">{{ m }}</div>
-          {% endfor %}
-        {% endif %}
-      {% endwith %}
-      {{ body | safe }}
-    </div>
+_BODY_SPLIT = '\x00BODY\x00'
+
+def _render_shell(**context):
+    return tuple(render_template('base.html', body=_BODY_SPLIT, **context).split(_BODY_SPLIT))
+
+
+@lru_cache(maxsize=256)
+def _cached_shell(logged_in, role, full_name, script_root):
+    nav_session = {'user_id': logged_in, 'role': role, 'full_name': full_name} if logged_in else {}
+    return _render_shell(session=nav_session)
+
+
+def page_shell():
+    # Layout (HTML sebelum & sesudah body) hanya bergantung pada user yang login,
+    # jadi di-render sekali per user. Flash message yang tertunda butuh render penuh.
+    if session.get('_flashes'):
+        return _render_shell()
+    return _cached_shell('user_id' in session, session.get('role'), session.get('full_name'), request.script_root)
 
-    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
-  </body>
-</html>
-"""
+
+def render_page(body):
+    pre, post = page_shell()
+    return ''.join((pre, body, post))
+
+
+def stream_page(head, rows, tail):
+    # layout diambil sekarang (flash message ikut terbaca), baris tabel dikirim sambil di-fetch
+    pre, post = page_shell()
+    def generate():
+        yield pre
+        yield head
+        yield from rows
+        yield tail
+        yield post
+    return Response(stream_with_context(generate()))
+
+
+def url_prefix(endpoint, **values):
+    # URL tanpa segmen id terakhir; di dalam loop cukup prefix + id
+    return url_for(endpoint, **values).rsplit('/', 1)[0] + '/'
+
+# Template baris HTML. Markup.format/format_map meng-escape setiap nilai yang dimasukkan.
+OPTION_HTML = Markup("<option value='{0}'>{1}</option>")
 
 # -----------------
 # Routes: index & auth
@@ -268,15 +433,18 @@ def index():
       </div>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
-        user = query_db('SELECT * FROM users WHERE username=?', (username,), one=True)
-        if user and check_password_hash(user['password_hash'], password):
+        user = query_db(_SQL_GET_USER, (username,), one=True)
+        if user and verify_password(user['password_hash'], password):
+            if not user['password_hash'].startswith('$2') and not password_too_long(password):
+                # migrasi hash pbkdf2 lama ke bcrypt (password > 72 byte tetap pbkdf2)
+                execute_db('UPDATE users SET password_hash=? WHERE id=?', (hash_password(password), user['id']))
             session['user_id'] = user['id']
             session['role'] = user['role']
             session['full_name'] = user['full_name']
@@ -306,7 +474,7 @@ def login():
       </div>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/logout')
 def logout():
@@ -320,11 +488,11 @@ def logout():
 
 @app.route('/admin')
 @login_required(role='admin')
+@etag_from(['mahasiswa', 'dosen', 'mata_kuliah'])
 def admin_dashboard():
     # summary counts
-    total_mhs = query_db('SELECT COUNT(*) as c FROM mahasiswa', one=True)['c']
-    total_dosen = query_db("SELECT COUNT(*) as c FROM dosen", one=True)['c']
-    total_mk = query_db('SELECT COUNT(*) as c FROM mata_kuliah', one=True)['c']
+    row = query_db(_SQL_COUNTS, one=True)
+    total_mhs, total_dosen, total_mk = row['a'], row['b'], row['c']
     body = f'''
     <div class="row">
       <div class="col-md-12">
@@ -343,40 +511,44 @@ def admin_dashboard():
       </div>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 # Manage mahasiswa
-@app.route('/admin/mahasiswa')
-@login_required(role='admin')
-def manage_mahasiswa():
-    mhs = query_db('SELECT u.id, u.username, u.full_name, m.nim, m.alamat, m.phone FROM users u JOIN mahasiswa m ON u.id=m.id')
-    rows = ''
-    for r in mhs:
-        rows += f"""
+MAHASISWA_ROW = Markup("""
         <tr>
-          <td>{r['id']}</td>
-          <td>{r['username']}</td>
-          <td>{r['full_name']}</td>
-          <td>{r['nim']}</td>
-          <td>{r['alamat']}</td>
-          <td>{r['phone']}</td>
+          <td>{id}</td>
+          <td>{username}</td>
+          <td>{full_name}</td>
+          <td>{nim}</td>
+          <td>{alamat}</td>
+          <td>{phone}</td>
           <td>
-            <a class='btn btn-sm btn-warning' href='{url_for('edit_mahasiswa', mhs_id=r['id'])}'>Edit</a>
-            <a class='btn btn-sm btn-danger' href='{url_for('delete_mahasiswa', mhs_id=r['id'])}' onclick="return confirm('Hapus?')">Hapus</a>
+            <a class='btn btn-sm btn-warning' href='{edit_prefix}{id}'>Edit</a>
+            <a class='btn btn-sm btn-danger' href='{delete_prefix}{id}' onclick="return confirm('Hapus?')">Hapus</a>
           </td>
         </tr>
-        """
-    body = f"""
+        """)
+
+@app.route('/admin/mahasiswa')
+@login_required(role='admin')
+def manage_mahasiswa():
+    edit_prefix = url_prefix('edit_mahasiswa', mhs_id=0)
+    delete_prefix = url_prefix('delete_mahasiswa', mhs_id=0)
+    def rows():
+        for r in get_db().execute('SELECT u.id, u.username, u.full_name, m.nim, m.alamat, m.phone FROM users u JOIN mahasiswa m ON u.id=m.id'):
+            yield MAHASISWA_ROW.format_map(dict(r, edit_prefix=edit_prefix, delete_prefix=delete_prefix))
+    head = f"""
     <div class='card card-glow p-3'>
       <h4>Daftar Mahasiswa</h4>
       <a class='btn btn-success' href='{url_for('add_mahasiswa')}'>Tambah Mahasiswa</a>
       <table class='table table-striped mt-3'>
         <thead><tr><th>ID</th><th>Username</th><th>Nama</th><th>NIM</th><th>Alamat</th><th>HP</th><th>Aksi</th></tr></thead>
-        <tbody>{rows}</tbody>
+        <tbody>"""
+    tail = """</tbody>
       </table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return stream_page(head, rows(), tail)
 
 @app.route('/admin/mahasiswa/add', methods=['GET', 'POST'])
 @login_required(role='admin')
@@ -388,11 +560,12 @@ def add_mahasiswa():
         nim = request.form['nim']
         alamat = request.form['alamat']
         phone = request.form['phone']
-        pw_hash = generate_password_hash(password)
         try:
-            uid = execute_db('INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)',
-                            (username, pw_hash, 'mahasiswa', full_name))
-            execute_db('INSERT INTO mahasiswa (id, nim, alamat, phone) VALUES (?,?,?,?)', (uid, nim, alamat, phone))
+            pw_hash = hash_password(password)
+            with tx() as db:
+                uid = db.execute('INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)',
+                                 (username, pw_hash, 'mahasiswa', full_name)).lastrowid
+                db.execute('INSERT INTO mahasiswa (id, nim, alamat, phone) VALUES (?,?,?,?)', (uid, nim, alamat, phone))
             flash('Mahasiswa ditambahkan')
             return redirect(url_for('manage_mahasiswa'))
         except Exception as e:
@@ -411,12 +584,12 @@ def add_mahasiswa():
       </form>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/mahasiswa/edit/<int:mhs_id>', methods=['GET', 'POST'])
 @login_required(role='admin')
 def edit_mahasiswa(mhs_id):
-    user = query_db('SELECT u.*, m.nim, m.alamat, m.phone FROM users u JOIN mahasiswa m ON u.id=m.id WHERE u.id=?', (mhs_id,), one=True)
+    user = query_db(_SQL_MHS_PROFILE, (mhs_id,), one=True)
     if not user:
         flash('Mahasiswa tidak ditemukan')
         return redirect(url_for('manage_mahasiswa'))
@@ -433,40 +606,45 @@ def edit_mahasiswa(mhs_id):
     <div class='card p-3'>
       <h4>Edit Mahasiswa</h4>
       <form method='post'>
-        <div class='mb-2'><label>Nama Lengkap</label><input class='form-control' name='full_name' value="{user['full_name']}" required></div>
-        <div class='mb-2'><label>NIM</label><input class='form-control' name='nim' value="{user['nim'] or ''}"></div>
-        <div class='mb-2'><label>Alamat</label><input class='form-control' name='alamat' value="{user['alamat'] or ''}"></div>
-        <div class='mb-2'><label>HP</label><input class='form-control' name='phone' value="{user['phone'] or ''}"></div>
+        <div class='mb-2'><label>Nama Lengkap</label><input class='form-control' name='full_name' value="{escape(user['full_name'])}" required></div>
+        <div class='mb-2'><label>NIM</label><input class='form-control' name='nim' value="{escape(user['nim'] or '')}"></div>
+        <div class='mb-2'><label>Alamat</label><input class='form-control' name='alamat' value="{escape(user['alamat'] or '')}"></div>
+        <div class='mb-2'><label>HP</label><input class='form-control' name='phone' value="{escape(user['phone'] or '')}"></div>
         <button class='btn btn-primary'>Simpan</button>
       </form>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/mahasiswa/delete/<int:mhs_id>')
 @login_required(role='admin')
 def delete_mahasiswa(mhs_id):
     try:
-        execute_db('DELETE FROM nilai WHERE enroll_id IN (SELECT id FROM enroll WHERE mahasiswa_id=?)', (mhs_id,))
-        execute_db('DELETE FROM enroll WHERE mahasiswa_id=?', (mhs_id,))
-        execute_db('DELETE FROM mahasiswa WHERE id=?', (mhs_id,))
-        execute_db('DELETE FROM users WHERE id=?', (mhs_id,))
+        # hapus eksplisit agar database lama (tanpa ON DELETE CASCADE) tidak meninggalkan
+        # baris yatim; semua dalam satu transaksi
+        with tx() as db:
+            db.execute('DELETE FROM nilai WHERE enroll_id IN (SELECT id FROM enroll WHERE mahasiswa_id=?)', (mhs_id,))
+            db.execute('DELETE FROM enroll WHERE mahasiswa_id=?', (mhs_id,))
+            db.execute('DELETE FROM mahasiswa WHERE id=?', (mhs_id,))
+            db.execute('DELETE FROM users WHERE id=?', (mhs_id,))
         flash('Mahasiswa dihapus')
     except Exception as e:
         flash('Gagal hapus: ' + str(e))
     return redirect(url_for('manage_mahasiswa'))
 
 # Manage dosen
+DOSEN_ROW = Markup("""
+        <tr><td>{id}</td><td>{username}</td><td>{full_name}</td><td>{nidn}</td>
+        <td><a class='btn btn-sm btn-danger' href='{delete_prefix}{id}' onclick="return confirm('Hapus?')">Hapus</a></td></tr>
+        """)
+
 @app.route('/admin/dosen')
 @login_required(role='admin')
+@etag_from(['dosen', 'users'])
 def manage_dosen():
     dsn = query_db('SELECT u.id, u.username, u.full_name, d.nidn FROM users u JOIN dosen d ON u.id=d.id')
-    rows = ''
-    for r in dsn:
-        rows += f"""
-        <tr><td>{r['id']}</td><td>{r['username']}</td><td>{r['full_name']}</td><td>{r['nidn']}</td>
-        <td><a class='btn btn-sm btn-danger' href='{url_for('delete_dosen', dosen_id=r['id'])}' onclick="return confirm('Hapus?')">Hapus</a></td></tr>
-        """
+    delete_prefix = url_prefix('delete_dosen', dosen_id=0)
+    rows = ''.join([DOSEN_ROW.format_map(dict(r, delete_prefix=delete_prefix)) for r in dsn])
     body = f"""
     <div class='card p-3'>
       <h4>Daftar Dosen</h4>
@@ -474,7 +652,7 @@ def manage_dosen():
       <table class='table table-striped mt-3'><thead><tr><th>ID</th><th>Username</th><th>Nama</th><th>NIDN</th><th>Aksi</th></tr></thead><tbody>{rows}</tbody></table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/dosen/add', methods=['GET', 'POST'])
 @login_required(role='admin')
@@ -484,11 +662,12 @@ def add_dosen():
         full_name = request.form['full_name']
         password = request.form['password']
         nidn = request.form['nidn']
-        pw_hash = generate_password_hash(password)
         try:
-            uid = execute_db('INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)',
-                            (username, pw_hash, 'dosen', full_name))
-            execute_db('INSERT INTO dosen (id, nidn) VALUES (?,?)', (uid, nidn))
+            pw_hash = hash_password(password)
+            with tx() as db:
+                uid = db.execute('INSERT INTO users (username, password_hash, role, full_name) VALUES (?,?,?,?)',
+                                 (username, pw_hash, 'dosen', full_name)).lastrowid
+                db.execute('INSERT INTO dosen (id, nidn) VALUES (?,?)', (uid, nidn))
             flash('Dosen ditambahkan')
             return redirect(url_for('manage_dosen'))
         except Exception as e:
@@ -505,38 +684,43 @@ def add_dosen():
       </form>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/dosen/delete/<int:dosen_id>')
 @login_required(role='admin')
 def delete_dosen(dosen_id):
     try:
-        execute_db('DELETE FROM dosen WHERE id=?', (dosen_id,))
-        execute_db('DELETE FROM users WHERE id=?', (dosen_id,))
+        # sama seperti ON DELETE SET NULL/CASCADE, tetapi juga berlaku di database lama
+        with tx() as db:
+            db.execute('UPDATE kelas SET dosen_id=NULL WHERE dosen_id=?', (dosen_id,))
+            db.execute('DELETE FROM dosen WHERE id=?', (dosen_id,))
+            db.execute('DELETE FROM users WHERE id=?', (dosen_id,))
         flash('Dosen dihapus')
     except Exception as e:
         flash('Gagal hapus dosen: ' + str(e))
     return redirect(url_for('manage_dosen'))
 
 # Manage mata kuliah & kelas
+MATA_KULIAH_ROW = Markup("""
+        <tr><td>{id}</td><td>{kode}</td><td>{nama}</td><td>{sks}</td><td>{kelas_dosen}</td></tr>
+        """)
+
 @app.route('/admin/mata_kuliah')
 @login_required(role='admin')
+@etag_from(['mata_kuliah', 'kelas', 'dosen'])
 def manage_mata_kuliah():
-    mks = query_db('SELECT mk.*, k.nama as kelas_nama, u.full_name as dosen_name FROM mata_kuliah mk LEFT JOIN kelas k ON mk.id=k.mata_kuliah_id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id')
-    rows = ''
-    for r in mks:
-        rows += f"""
-        <tr><td>{r['id']}</td><td>{r['kode']}</td><td>{r['nama']}</td><td>{r['sks']}</td><td>{r['kelas_nama'] or '-'}</td><td>{r['dosen_name'] or '-'}</td></tr>
-        """
+    # satu baris per mata kuliah; pasangan kelas (dosen) digabung dengan GROUP_CONCAT
+    mks = query_db("SELECT mk.id, mk.kode, mk.nama, mk.sks, COALESCE(GROUP_CONCAT(k.nama || ' (' || COALESCE(u.full_name, '-') || ')', ', '), '-') as kelas_dosen FROM mata_kuliah mk LEFT JOIN kelas k ON mk.id=k.mata_kuliah_id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id GROUP BY mk.id")
+    rows = ''.join([MATA_KULIAH_ROW.format_map(r) for r in mks])
     body = f"""
     <div class='card p-3'>
       <h4>Mata Kuliah & Kelas</h4>
       <a class='btn btn-success' href='{url_for('add_mata_kuliah')}'>Tambah Mata Kuliah</a>
       <a class='btn btn-secondary' href='{url_for('manage_kelas')}'>Kelola Kelas</a>
-      <table class='table table-striped mt-3'><thead><tr><th>ID</th><th>Kode</th><th>Nama</th><th>SKS</th><th>Kelas</th><th>Dosen</th></tr></thead><tbody>{rows}</tbody></table>
+      <table class='table table-striped mt-3'><thead><tr><th>ID</th><th>Kode</th><th>Nama</th><th>SKS</th><th>Kelas (Dosen)</th></tr></thead><tbody>{rows}</tbody></table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/mata_kuliah/add', methods=['GET', 'POST'])
 @login_required(role='admin')
@@ -559,23 +743,26 @@ def add_mata_kuliah():
       </form>
     </div>
     '''
-    return render_template_string(base_html, body=body)
+    return render_page(body)
+
+KELAS_ROW = Markup("""
+        <tr><td>{id}</td><td>{nama}</td><td>{mk_nama}</td><td>{dosen_name}</td>
+        <td><a class='btn btn-sm btn-primary' href='{view_prefix}{id}'>Lihat</a></td></tr>
+        """)
 
 @app.route('/admin/kelas')
 @login_required(role='admin')
+@etag_from(['kelas', 'mata_kuliah', 'dosen'])
 def manage_kelas():
-    kelas = query_db('SELECT k.*, mk.nama as mk_nama, u.full_name as dosen_name FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id')
     dosen = query_db('SELECT u.id, u.full_name FROM users u JOIN dosen d ON u.id=d.id')
-    mk = query_db('SELECT * FROM mata_kuliah')
-    rows = ''
-    for r in kelas:
-        rows += f"""
-        <tr><td>{r['id']}</td><td>{r['nama']}</td><td>{r['mk_nama']}</td><td>{r['dosen_name'] or '-'}</td>
-        <td><a class='btn btn-sm btn-primary' href='{url_for('view_kelas', kelas_id=r['id'])}'>Lihat</a></td></tr>
-        """
-    options_dosen = ''.join([f"<option value='{d['id']}'>{d['full_name']}</option>" for d in dosen])
-    options_mk = ''.join([f"<option value='{m['id']}'>{m['nama']}</option>" for m in mk])
-    body = f"""
+    mk = query_db('SELECT id, nama FROM mata_kuliah')
+    view_prefix = url_prefix('view_kelas', kelas_id=0)
+    def rows():
+        for r in get_db().execute("SELECT k.id, k.nama, mk.nama as mk_nama, COALESCE(u.full_name, '-') as dosen_name FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id"):
+            yield KELAS_ROW.format_map(dict(r, view_prefix=view_prefix))
+    options_dosen = ''.join([OPTION_HTML.format(d['id'], d['full_name']) for d in dosen])
+    options_mk = ''.join([OPTION_HTML.format(m['id'], m['nama']) for m in mk])
+    head = f"""
     <div class='card p-3'>
       <h4>Kelola Kelas</h4>
       <form method='post' action='{url_for('add_kelas')}'>
@@ -587,10 +774,11 @@ def manage_kelas():
         <button class='btn btn-success mt-2'>Buat Kelas</button>
       </form>
       <hr>
-      <table class='table table-striped mt-3'><thead><tr><th>ID</th><th>Nama</th><th>Mata Kuliah</th><th>Dosen</th><th>Aksi</th></tr></thead><tbody>{rows}</tbody></table>
+      <table class='table table-striped mt-3'><thead><tr><th>ID</th><th>Nama</th><th>Mata Kuliah</th><th>Dosen</th><th>Aksi</th></tr></thead><tbody>"""
+    tail = """</tbody></table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return stream_page(head, rows(), tail)
 
 @app.route('/admin/kelas/add', methods=['POST'])
 @login_required(role='admin')
@@ -598,22 +786,32 @@ def add_kelas():
     nama = request.form['nama']
     mata_kuliah_id = int(request.form['mata_kuliah_id'])
     dosen_id = int(request.form['dosen_id'])
-    execute_db('INSERT INTO kelas (nama, mata_kuliah_id, dosen_id) VALUES (?,?,?)', (nama, mata_kuliah_id, dosen_id))
-    flash('Kelas dibuat')
+    try:
+        execute_db('INSERT INTO kelas (nama, mata_kuliah_id, dosen_id) VALUES (?,?,?)', (nama, mata_kuliah_id, dosen_id))
+        flash('Kelas dibuat')
+    except sqlite3.IntegrityError:
+        flash('Gagal membuat kelas: mata kuliah atau dosen tidak ditemukan')
     return redirect(url_for('manage_kelas'))
 
+ENROLL_ROW = Markup("<tr><td>{id}</td><td>{username}</td><td>{full_name}</td><td><a class='btn btn-sm btn-danger' href='{unenroll_prefix}{id}'>Unenroll</a></td></tr>")
+
 @app.route('/admin/kelas/<int:kelas_id>')
 @login_required(role='admin')
 def view_kelas(kelas_id):
-    k = query_db('SELECT k.*, mk.nama as mk_nama, u.full_name as dosen_name FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id WHERE k.id=?', (kelas_id,), one=True)
+    k = query_db('SELECT k.nama, mk.nama as mk_nama, u.full_name as dosen_name FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN dosen d ON k.dosen_id=d.id LEFT JOIN users u ON d.id=u.id WHERE k.id=?', (kelas_id,), one=True)
+    if not k:
+        flash('Kelas tidak ditemukan')
+        return redirect(url_for('manage_kelas'))
     enrolled = query_db('SELECT e.id, u.full_name, u.username FROM enroll e JOIN mahasiswa m ON e.mahasiswa_id=m.id JOIN users u ON m.id=u.id WHERE e.kelas_id=?', (kelas_id,))
-    rows = ''.join([f"<tr><td>{r['id']}</td><td>{r['username']}</td><td>{r['full_name']}</td><td><a class='btn btn-sm btn-danger' href='{url_for('unenroll', enroll_id=r['id'], kelas_id=kelas_id)}'>Unenroll</a></td></tr>" for r in enrolled])
+    mhs_list = query_db('SELECT m.id, m.nim, u.full_name FROM mahasiswa m JOIN users u ON m.id=u.id')
+    unenroll_prefix = url_prefix('unenroll', kelas_id=kelas_id, enroll_id=0)
+    rows = ''.join([ENROLL_ROW.format_map(dict(r, unenroll_prefix=unenroll_prefix)) for r in enrolled])
     # simple enroll form for admin
-    mhs_opts = ''.join([f"<option value='{m['id']}'>{m['full_name']} ({m['nim']})</option>" for m in query_db('SELECT id, nim, full_name FROM mahasiswa m JOIN users u ON m.id=u.id')])
+    mhs_opts = ''.join([OPTION_HTML.format(m['id'], f"{m['full_name']} ({m['nim']})") for m in mhs_list])
     body = f"""
     <div class='card p-3'>
-      <h4>Detail Kelas: {k['nama']}</h4>
-      <p>Mata Kuliah: {k['mk_nama']} | Dosen: {k['dosen_name'] or '-'}</p>
+      <h4>Detail Kelas: {escape(k['nama'])}</h4>
+      <p>Mata Kuliah: {escape(k['mk_nama'])} | Dosen: {escape(k['dosen_name'] or '-')}</p>
       <form method='post' action='{url_for('enroll_mahasiswa', kelas_id=kelas_id)}'>
         <div class='row'><div class='col-md-8'><select class='form-control' name='mahasiswa_id'>{mhs_opts}</select></div><div class='col-md-4'><button class='btn btn-success'>Enroll Mahasiswa</button></div></div>
       </form>
@@ -622,39 +820,50 @@ def view_kelas(kelas_id):
       <table class='table'><thead><tr><th>ID</th><th>Username</th><th>Nama</th><th>Aksi</th></tr></thead><tbody>{rows}</tbody></table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return render_page(body)
 
 @app.route('/admin/kelas/<int:kelas_id>/enroll', methods=['POST'])
 @login_required(role='admin')
 def enroll_mahasiswa(kelas_id):
     mahasiswa_id = int(request.form['mahasiswa_id'])
-    execute_db('INSERT INTO enroll (mahasiswa_id, kelas_id) VALUES (?,?)', (mahasiswa_id, kelas_id))
-    flash('Mahasiswa di-enroll ke kelas')
+    try:
+        execute_db('INSERT INTO enroll (mahasiswa_id, kelas_id) VALUES (?,?)', (mahasiswa_id, kelas_id))
+        flash('Mahasiswa di-enroll ke kelas')
+    except sqlite3.IntegrityError:
+        flash('Gagal enroll: mahasiswa atau kelas tidak ditemukan')
     return redirect(url_for('view_kelas', kelas_id=kelas_id))
 
 @app.route('/admin/kelas/<int:kelas_id>/unenroll/<int:enroll_id>')
 @login_required(role='admin')
 def unenroll(kelas_id, enroll_id):
-    execute_db('DELETE FROM nilai WHERE enroll_id=?', (enroll_id,))
-    execute_db('DELETE FROM enroll WHERE id=?', (enroll_id,))
+    with tx() as db:
+        db.execute('DELETE FROM nilai WHERE enroll_id=?', (enroll_id,))
+        db.execute('DELETE FROM enroll WHERE id=?', (enroll_id,))
     flash('Mahasiswa dikeluarkan dari kelas')
     return redirect(url_for('view_kelas', kelas_id=kelas_id))
 
 # jadwal
+JADWAL_ROW = Markup("<tr><td>{id}</td><td>{kelas_nama}</td><td>{hari}</td><td>{jam}</td></tr>")
+
 @app.route('/admin/jadwal', methods=['GET','POST'])
 @login_required(role='admin')
+@etag_from(['jadwal', 'kelas'])
 def manage_jadwal():
     if request.method == 'POST':
         kelas_id = int(request.form['kelas_id'])
         hari = request.form['hari']
         jam = request.form['jam']
-        execute_db('INSERT INTO jadwal (kelas_id, hari, jam) VALUES (?,?,?)', (kelas_id, hari, jam))
-        flash('Jadwal ditambahkan')
+        try:
+            execute_db('INSERT INTO jadwal (kelas_id, hari, jam) VALUES (?,?,?)', (kelas_id, hari, jam))
+            flash('Jadwal ditambahkan')
+        except sqlite3.IntegrityError:
+            flash('Gagal menambah jadwal: kelas tidak ditemukan')
         return redirect(url_for('manage_jadwal'))
-    jadwals = query_db('SELECT j.*, k.nama as kelas_nama FROM jadwal j JOIN kelas k ON j.kelas_id=k.id')
-    kelas_opts = ''.join([f"<option value='{k['id']}'>{k['nama']}</option>" for k in query_db('SELECT id, nama FROM kelas')])
-    rows = ''.join([f"<tr><td>{r['id']}</td><td>{r['kelas_nama']}</td><td>{r['hari']}</td><td>{r['jam']}</td></tr>" for r in jadwals])
-    body = f"""
+    kelas_opts = ''.join([OPTION_HTML.format(k['id'], k['nama']) for k in query_db('SELECT id, nama FROM kelas')])
+    def rows():
+        for r in get_db().execute('SELECT j.id, j.hari, j.jam, k.nama as kelas_nama FROM jadwal j JOIN kelas k ON j.kelas_id=k.id'):
+            yield JADWAL_ROW.format_map(r)
+    head = f"""
     <div class='card p-3'>
       <h4>Kelola Jadwal</h4>
       <form method='post'>
@@ -664,97 +873,144 @@ def manage_jadwal():
         <button class='btn btn-success mt-2'>Tambah Jadwal</button>
       </form>
       <hr>
-      <table class='table'><thead><tr><th>ID</th><th>Kelas</th><th>Hari</th><th>Jam</th></tr></thead><tbody>{rows}</tbody></table>
+      <table class='table'><thead><tr><th>ID</th><th>Kelas</th><th>Hari</th><th>Jam</th></tr></thead><tbody>"""
+    tail = """</tbody></table>
     </div>
     """
-    return render_template_string(base_html, body=body)
+    return stream_page(head, rows(), tail)
 
 # -----------------
 # Dosen area
 # -----------------
 
+# potongan HTML statis: body = ''.join((..._HEAD, rows, ..._TAIL))
+TABLE_CARD_TAIL = """</tbody></table>
+    </div>
+    """
+
+DOSEN_DASHBOARD_HEAD = """
+    <div class='card p-3'>
+      <h4>Dashboard Dosen</h4>
+      <ul class='list-group'>"""
+DOSEN_DASHBOARD_TAIL = """</ul>
+    </div>
+    """
+DOSEN_KELAS_ITEM = Markup("<li class='list-group-item'><a href='{}'>{} - {}</a></li>").format
+
 @app.route('/dosen')
 @login_required(role='dosen')
+@etag_body
 def dosen_dashboard():
     # list kelas yang dia ampu
-    kelas = query_db('SELECT k.*, mk.nama as mk_nama FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id WHERE k.dosen_id=?', (session['user_id'],))
-    rows = ''.join([f"<li class='list-group-item'><a href='{url_for('dosen_view_kelas', kelas_id=k['id'])}'>{k['nama']} - {k['mk_nama']}</a></li>" for k in kelas])
-    body = f"""
+    kelas = query_db(_SQL_DOSEN_KELAS, (session['user_id'],), row_as_tuple=True)
+    view_prefix = url_prefix('dosen_view_kelas', kelas_id=0)
+    rows = ''.join([DOSEN_KELAS_ITEM(f"{view_prefix}{kid}", nama, mk_nama) for (kid, nama, mk_nama) in kelas])
+    body = ''.join((DOSEN_DASHBOARD_HEAD, rows, DOSEN_DASHBOARD_TAIL))
+    return render_page(body)
+
+DOSEN_KELAS_HEAD = """
     <div class='card p-3'>
-      <h4>Dashboard Dosen</h4>
-      <ul class='list-group'>{rows}</ul>
-    </div>
-    """
-    return render_template_string(base_html, body=body)
+      <h4>"""
+DOSEN_KELAS_JADWAL = """</h4>
+      <p class='text-muted'>Jadwal: """
+DOSEN_KELAS_MID = """</p>
+      <table class='table'><thead><tr><th>ID Enroll</th><th>Username</th><th>Nama</th><th>Nilai</th><th>Aksi</th></tr></thead><tbody>"""
+DOSEN_ENROLL_ROW = Markup("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td><a class='btn btn-sm btn-primary' href='{}'>Set Nilai</a></td></tr>").format
 
 @app.route('/dosen/kelas/<int:kelas_id>')
 @login_required(role='dosen')
 def dosen_view_kelas(kelas_id):
-    k = query_db('SELECT k.*, mk.nama as mk_nama FROM kelas k JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id WHERE k.id=? AND k.dosen_id=?', (kelas_id, session['user_id']), one=True)
+    k = query_db(_SQL_DOSEN_KELAS_DETAIL, (kelas_id, session['user_id']), one=True, row_as_tuple=True)
     if not k:
         flash('Kelas tidak ditemukan atau Anda bukan pengampu')
         return redirect(url_for('dosen_dashboard'))
-    enrolled = query_db('SELECT e.id, u.full_name, u.username, n.nilai_angka FROM enroll e JOIN mahasiswa m ON e.mahasiswa_id=m.id JOIN users u ON m.id=u.id LEFT JOIN nilai n ON n.enroll_id=e.id WHERE e.kelas_id=?', (kelas_id,))
-    rows = ''.join([f"<tr><td>{r['id']}</td><td>{r['username']}</td><td>{r['full_name']}</td><td>{r['nilai_angka'] or '-'}</td><td><a class='btn btn-sm btn-primary' href='{url_for('dosen_set_nilai', enroll_id=r['id'])}'>Set Nilai</a></td></tr>" for r in enrolled])
-    body = f"""
+    kelas_nama, mk_nama = k
+    # jadwal kelas diambil sekali untuk seluruh halaman, bukan per baris enroll
+    jadwal = query_db(_SQL_KELAS_JADWAL, (kelas_id,), row_as_tuple=True)
+    jadwal_text = escape(', '.join([f"{hari} {jam}" for (hari, jam) in jadwal]) or '-')
+    nilai_prefix = url_prefix('dosen_set_nilai', enroll_id=0)
+    def rows():
+        cur = get_db().cursor()
+        cur.row_factory = None
+        for (i, fn, un, n) in cur.execute(_SQL_KELAS_NILAI, (kelas_id,)):
+            yield DOSEN_ENROLL_ROW(i, un, fn, n or '-', f"{nilai_prefix}{i}")
+    head = ''.join((DOSEN_KELAS_HEAD, escape(kelas_nama), ' - ', escape(mk_nama), DOSEN_KELAS_JADWAL, jadwal_text, DOSEN_KELAS_MID))
+    return stream_page(head, rows(), TABLE_CARD_TAIL)
+
+SET_NILAI_FORM = Markup("""
     <div class='card p-3'>
-      <h4>{k['nama']} - {k['mk_nama']}</h4>
-      <table class='table'><thead><tr><th>ID Enroll</th><th>Username</th><th>Nama</th><th>Nilai</th><th>Aksi</th></tr></thead><tbody>{rows}</tbody></table>
+      <h4>Set Nilai</h4>
+      <form method='post'>
+        <input type='hidden' name='kelas_id' value='{kelas_id}'>
+        <div class='mb-2'><label>Nilai</label><input class='form-control' name='nilai' required></div>
+        <button class='btn btn-primary'>Simpan</button>
+      </form>
     </div>
-    """
-    return render_template_string(base_html, body=body)
+    """).format
+
+# angka 0-100, opsional desimal; diperiksa sebelum float() agar input rusak tidak jadi 500
+_NILAI_RE = re.compile(r'\d{1,3}(?:\.\d+)?')
 
 @app.route('/dosen/nilai/set/<int:enroll_id>', methods=['GET','POST'])
 @login_required(role='dosen')
+@etag_body
 def dosen_set_nilai(enroll_id):
+    if request.method == 'POST':
+        raw = request.form.get('nilai', '').strip()
+        if not _NILAI_RE.fullmatch(raw) or not 0 <= float(raw) <= 100:
+            flash('Nilai tidak valid')
+            return redirect(url_for('dosen_set_nilai', enroll_id=enroll_id))
+        nilai = float(raw)
+        # cek pengampu dilakukan di dalam upsert (lihat _SQL_UPSERT_NILAI)
+        with tx() as db:
+            saved = db.execute(_SQL_UPSERT_NILAI, (nilai, enroll_id, session['user_id'])).rowcount
+        if not saved:
+            flash('Akses ditolak')
+            return redirect(url_for('dosen_dashboard'))
+        flash('Nilai tersimpan')
+        # kelas_id hanya tujuan redirect; dosen_view_kelas tetap mengecek pengampu
+        kelas_id = request.form.get('kelas_id', type=int)
+        if kelas_id is None:
+            return redirect(url_for('dosen_dashboard'))
+        return redirect(url_for('dosen_view_kelas', kelas_id=kelas_id))
     # check that this enrollment belongs to a class the dosen teaches
-    e = query_db('SELECT e.*, k.dosen_id FROM enroll e JOIN kelas k ON e.kelas_id=k.id WHERE e.id=?', (enroll_id,), one=True)
-    if not e or e['dosen_id'] != session['user_id']:
+    e = query_db(_SQL_ENROLL_DOSEN, (enroll_id,), one=True, row_as_tuple=True)
+    kelas_id, dosen_id = e or (None, None)
+    if dosen_id != session['user_id']:
         flash('Akses ditolak')
         return redirect(url_for('dosen_dashboard'))
-    if request.method == 'POST':
-        nilai = float(request.form['nilai'])
-        existing = query_db('SELECT * FROM nilai WHERE enroll_id=?', (enroll_id,), one=True)
-        if existing:
-            execute_db('UPDATE nilai SET nilai_angka=? WHERE enroll_id=?', (nilai, enroll_id))
-        else:
-            execute_db('INSERT INTO nilai (enroll_id, nilai_angka) VALUES (?,?)', (enroll_id, nilai))
-        flash('Nilai tersimpan')
-        return redirect(url_for('dosen_view_kelas', kelas_id=e['kelas_id']))
-    body = f"""
-    <div class='card p-3'>
-      <h4>Set Nilai</h4>
-      <form method='post'>
-        <div class='mb-2'><label>Nilai</label><input class='form-control' name='nilai' required></div>
-        <button class='btn btn-primary'>Simpan</button>
-      </form>
-    </div>
-    """
-    return render_template_string(base_html, body=body)
+    return render_page(SET_NILAI_FORM(kelas_id=kelas_id))
 
 # -----------------
 # Mahasiswa area
 # -----------------
 
+MHS_PROFILE_HEAD = Markup("""
+    <div class='card p-3'>
+      <h4>Profil Mahasiswa</h4>
+      <p><strong>{full_name}</strong> ({nim})</p>
+      <p>Alamat: {alamat} | HP: {phone}</p>
+      <hr>
+      <h5>Jadwal & Nilai</h5>
+      <table class='table'><thead><tr><th>Mata Kuliah</th><th>Kelas</th><th>Hari</th><th>Jam</th><th>Nilai</th></tr></thead><tbody>""").format_map
+MHS_KELAS_ROW = Markup("<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>").format
+
 @app.route('/mahasiswa')
 @login_required(role='mahasiswa')
+@etag_body
 def mhs_dashboard():
     uid = session['user_id']
-    user = query_db('SELECT u.*, m.nim, m.alamat, m.phone FROM users u JOIN mahasiswa m ON u.id=m.id WHERE u.id=?', (uid,), one=True)
+    user = query_db(_SQL_MHS_PROFILE, (uid,), one=True)
+    if user is None:
+        # akun dihapus saat masih login
+        session.clear()
+        flash('Akun tidak ditemukan, silakan login kembali')
+        return redirect(url_for('login'))
     # kelas dan nilai
-    kelas = query_db('SELECT k.nama as kelas_nama, mk.nama as mk_nama, n.nilai_angka, j.hari, j.jam FROM enroll e JOIN kelas k ON e.kelas_id=k.id JOIN mata_kuliah mk ON k.mata_kuliah_id=mk.id LEFT JOIN nilai n ON n.enroll_id=e.id LEFT JOIN jadwal j ON j.kelas_id=k.id WHERE e.mahasiswa_id=?', (uid,))
-    rows = ''.join([f"<tr><td>{r['mk_nama']}</td><td>{r['kelas_nama']}</td><td>{r['hari'] or '-'}</td><td>{r['jam'] or '-'}</td><td>{r['nilai_angka'] or '-'}</td></tr>" for r in kelas])
-    body = f"""
-    <div class='card p-3'>
-      <h4>Profil Mahasiswa</h4>
-      <p><strong>{user['full_name']}</strong> ({user['nim']})</p>
-      <p>Alamat: {user['alamat']} | HP: {user['phone']}</p>
-      <hr>
-      <h5>Jadwal & Nilai</h5>
-      <table class='table'><thead><tr><th>Mata Kuliah</th><th>Kelas</th><th>Hari</th><th>Jam</th><th>Nilai</th></tr></thead><tbody>{rows}</tbody></table>
-    </div>
-    """
-    return render_template_string(base_html, body=body)
+    kelas = query_db(_SQL_MHS_KELAS, (uid,), row_as_tuple=True)
+    rows = ''.join([MHS_KELAS_ROW(mk_nama, kelas_nama, hari or '-', jam or '-', n or '-') for (kelas_nama, mk_nama, n, hari, jam) in kelas])
+    body = ''.join((MHS_PROFILE_HEAD(user), rows, TABLE_CARD_TAIL))
+    return render_page(body)
 
 # -----------------
 # Run app
@@ -762,4 +1018,11 @@ def mhs_dashboard():
 
 if __name__ == '__main__':
     init_db()
-    app.run(debug=True)
+    try:
+        from waitress import serve
+    except ImportError:
+        # waitress belum terpasang: pakai server pengembangan Flask
+        app.run(debug=True)
+    else:
+        # 8 thread, masing-masing dengan koneksi sqlite sendiri di _pool
+        serve(app, threads=8)